@@ -1,11 +1,27 @@
 import math
 import statistics
+import threading
 import warnings
 
 import numpy as np
+import pandas as pd
 from hmmlearn.hmm import GaussianHMM
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.model_selection import KFold
 from asl_utils import combine_sequences
+from my_scoring import as_feature_columns, fast_score
+
+# EM settings shared by every model fit during selection, EM almost always converges within
+# tol in well under 100 iterations and the ones that do not are not worth 1000
+HMM_KW = dict(covariance_type="diag", n_iter=100, tol=1e-2, verbose=False)
+
+# errors hmmlearn raises for a candidate that cannot be fit or scored, e.g. more states than samples
+# or rows of transmat_ that do not sum to 1.0
+HMM_ERRORS = (ValueError, np.linalg.LinAlgError)
+
+# installed once at import, not on every base_model and select call
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+warnings.filterwarnings("ignore", category=RuntimeWarning)
 
 
 class ModelSelector(object):
@@ -16,32 +32,33 @@ class ModelSelector(object):
     def __init__(self, all_word_sequences: dict, all_word_Xlengths: dict, this_word: str,
                  n_constant=3,
                  min_n_components=2, max_n_components=10,
-                 random_state=14, verbose=False):
+                 random_state=14, verbose=False, n_jobs=-1):
         self.words = all_word_sequences
         self.hwords = all_word_Xlengths
         self.sequences = all_word_sequences[this_word]
         self.X, self.lengths = all_word_Xlengths[this_word]
+        # a model cannot have more states than frames in its shortest sequence, candidates above that are
+        # skipped before any GaussianHMM is built
+        self._min_len = int(min(self.lengths))
         self.this_word = this_word
         self.n_constant = n_constant
         self.min_n_components = min_n_components
         self.max_n_components = max_n_components
         self.random_state = random_state
         self.verbose = verbose
+        self.n_jobs = n_jobs
 
     def select(self):
         raise NotImplementedError
 
     def base_model(self, num_states):
-        # with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        # warnings.filterwarnings("ignore", category=RuntimeWarning)
         try:
-            hmm_model = GaussianHMM(n_components=num_states, covariance_type="diag", n_iter=1000,
-                                    random_state=self.random_state, verbose=False).fit(self.X, self.lengths)
+            hmm_model = GaussianHMM(n_components=num_states, random_state=self.random_state,
+                                    **HMM_KW).fit(self.X, self.lengths)
             if self.verbose:
                 print("model created for {} with {} states".format(self.this_word, num_states))
             return hmm_model
-        except:
+        except HMM_ERRORS:
             if self.verbose:
                 print("failure on {} with {} states".format(self.this_word, num_states))
             return None
@@ -71,50 +88,91 @@ class SelectorBIC(ModelSelector):
 
     # NOTE: L is the likelihood of the fitted model, p is the number of parameters, and N is the number of data points
 
+    # number of consecutive candidates without a lower BIC before the search stops early
+    patience = 2
+
+    def __init__(self, *args, early_stop=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.early_stop = early_stop
+
     def select(self):
         """ select the best model for self.this_word based on
         BIC score for n between self.min_n_components and self.max_n_components
 
+        With self.early_stop the search ends once self.patience consecutive candidates
+        failed to lower the BIC, candidates are then fit one pool sized batch at a time.
+
         :return: GaussianHMM object
         """
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-
         best_model = None
         best_num_components = 0
-
-        # The
         best_score = float("inf")
 
-        for i in range(self.min_n_components,self.max_n_components + 1) :
+        # loop invariant parts of the BIC score
+        n_features = self.X.shape[1]
+        N = len(self.lengths)
+        logN = math.log(N)
 
-            if i >= self.lengths[0] :
-                continue
+        candidates = [i for i in range(self.min_n_components, self.max_n_components + 1) if i <= self._min_len]
 
-            try :
+        batch_size = effective_n_jobs(self.n_jobs) if self.early_stop else len(candidates)
+        no_improve = 0
 
-                hmm_model = GaussianHMM(n_components=i, covariance_type="diag", n_iter=1000,
-                                        random_state=self.random_state, verbose=False).fit(self.X, self.lengths)
+        for start in range(0, len(candidates), max(batch_size, 1)) :
 
-                logL = hmm_model.score(self.X, self.lengths)
-                N = len(self.lengths)
-                p = i * i + 2 * i * len(self.X[0]) - 1
-                bic_score = -2 * logL + p * math.log(N)
+            results = Parallel(n_jobs=self.n_jobs, prefer="processes")(
+                delayed(_score_bic)(i, self.X, self.lengths, self.random_state, n_features, logN)
+                for i in candidates[start:start + batch_size])
 
-            except Exception as e:
-                # print(e)
-                return None
+            for result in results :
 
-            # print("score of {} for model with {} components".format(bic_score, i))
+                # a candidate that cannot be fit does not end the search, the others may still be valid
+                if result is None :
+                    continue
 
-            if bic_score < best_score :
-                best_score = bic_score
-                best_model = hmm_model
-                best_num_components = i
+                i, hmm_model, bic_score = result
+
+                # print("score of {} for model with {} components".format(bic_score, i))
+
+                if bic_score < best_score :
+                    best_score = bic_score
+                    best_model = hmm_model
+                    best_num_components = i
+                    no_improve = 0
+                else :
+                    no_improve += 1
+
+                if self.early_stop and no_improve >= self.patience :
+                    break
+
+            if self.early_stop and no_improve >= self.patience :
+                break
 
         # print("Best score of {} for model with {} components".format(best_score,best_num_components))
         return best_model
 
 
+def _score_bic(i, X, lengths, random_state, n_features, logN):
+    """ fit and BIC score one candidate of SelectorBIC
+
+    :param n_features: number of features in X
+    :param logN: log of the number of sequences in X
+
+    :return: (i, GaussianHMM, bic_score) or None if the candidate could not be fit
+    """
+    try :
+        hmm_model = GaussianHMM(n_components=i, random_state=random_state, **HMM_KW).fit(X, lengths)
+
+        logL = hmm_model.score(X, lengths)
+    except HMM_ERRORS as e:
+        # print(e)
+        return None
+
+    p = i * i + 2 * i * n_features - 1
+    bic_score = -2 * logL + p * logN
+    return i, hmm_model, bic_score
+
+
 class SelectorDIC(ModelSelector):
     ''' select best model based on Discriminative Information Criterion
 
@@ -124,80 +182,173 @@ class SelectorDIC(ModelSelector):
     DIC = log(P(X(i)) - 1/(M-1)SUM(log(P(X(all but i))
     '''
 
-    def select(self):
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-
-        # TODO implement model selection based on DIC scores
-        # Question to reviewer - Should we look at discriminitive capacity of some number of states vs other number of states, or of self.this_word vs other words? I think the former but want to clarify
-        best_model = None
-        best_num_components = 0
-
-        # The
-        best_score = float("-inf")
-
-        # print("Iterate thru range")
-        for i in range(self.min_n_components, self.max_n_components + 1):
-
-            # print("Testing n_components at: {}".format(i))
+    # the comparator models only depend on the other word's data, the number of states and the random state, so they
+    # are fit and scored once per process and shared by the SelectorDIC instances of every target word, the caches
+    # grow with every word, feature set and random state seen until clear_cache is called
+    _model_cache = {}
+    _score_cache = {}
+    _cache_lock = threading.Lock()
 
+    def __init__(self, *args, logL_table=None, **kwargs):
+        """ logL_table is an optional build_logL_table result shared by all target words,
+        it is built on each select call from the cached models otherwise
+        """
+        super().__init__(*args, **kwargs)
+        self.logL_table = logL_table
+
+    @classmethod
+    def clear_cache(cls):
+        """ drop the cached comparator models and scores, e.g. before training on another feature set """
+        with cls._cache_lock:
+            cls._model_cache.clear()
+            cls._score_cache.clear()
+
+    @staticmethod
+    def _fingerprint(X):
+        """ identifies X in the cache keys, hashing X is the costly part of a lookup so compute it once per word """
+        return X.shape, hash(np.ascontiguousarray(X).tobytes())
+
+    @classmethod
+    def comparator_model(cls, word, num_states, X, lengths, random_state, fingerprint=None):
+        """ GaussianHMM with num_states fit on the X, lengths of word, cached across target words
+
+        :param fingerprint: _fingerprint(X), computed here if None
+        :return: GaussianHMM object
+        """
+        if fingerprint is None:
+            fingerprint = cls._fingerprint(X)
+        key = word, num_states, random_state, fingerprint
+        with cls._cache_lock:
+            model = cls._model_cache.get(key)
+        if model is None:
+            model = GaussianHMM(n_components=num_states, random_state=random_state,
+                                **HMM_KW).fit(X, lengths)
+            with cls._cache_lock:
+                model = cls._model_cache.setdefault(key, model)
+        return model
+
+    @classmethod
+    def comparator_score(cls, word, num_states, X, lengths, random_state, X_cols=None, fingerprint=None):
+        """ log likelihood of word's X, lengths under its own comparator model, cached across target words
+
+        :param X_cols: X already converted with as_feature_columns, converted here if None
+        :param fingerprint: _fingerprint(X), computed here if None
+        :return: float log likelihood, NaN if the model could not be fit or fails hmmlearn's checks
+        """
+        if fingerprint is None:
+            fingerprint = cls._fingerprint(X)
+        key = word, num_states, random_state, fingerprint
+        with cls._cache_lock:
+            score = cls._score_cache.get(key)
+        if score is None:
             try:
+                other_hmm_model = cls.comparator_model(word, num_states, X, lengths, random_state, fingerprint)
+            except HMM_ERRORS as e:
+                # the fit fails the same way for every target word, remember the failure instead of refitting
+                other_hmm_model = None
+                score = np.nan
+            if other_hmm_model is not None:
+                try:
+                    other_hmm_model._check()
+                    if X_cols is None:
+                        X_cols = as_feature_columns(X)
+                    score = fast_score(other_hmm_model, X_cols, lengths)
+                except HMM_ERRORS as e:
+                    # e.g. rows of transmat_ must sum to 1.0, the model is unusable so it must neither be selected
+                    # for the target word nor count towards the other words' mean
+                    score = np.nan
+            with cls._cache_lock:
+                score = cls._score_cache.setdefault(key, score)
+        return score
+
+    def dic_scores(self, logL_table, candidates):
+        """ DIC of every candidate number of states with a score for this_word and at least one other word
+
+        :param logL_table: build_logL_table result including a row for this_word
+        :param candidates: iterable of numbers of states
+        :return: pandas Series of DIC scores indexed by number of states
+        """
+        dic_scores = {}
+        for i in candidates:
+            if i not in logL_table.columns:
+                continue
 
-                if i > self.lengths[0]:
-                    continue
-
-                hmm_model = GaussianHMM(n_components=i, covariance_type="diag", n_iter=1000,
-                                        random_state=self.random_state, verbose=False).fit(self.X, self.lengths)
+            this_model_score = logL_table.at[self.this_word, i]
+            other_model_scores = logL_table[i].drop(self.this_word).dropna()
+            if np.isnan(this_model_score) or len(other_model_scores) == 0:
+                continue
 
-                # Question to reviewer - it is a bug in HMMLearn that this sometimes returns a negative number as a log probability
-                # https://discussions.udacity.com/t/logl-negative-in-cell-with-chocolate-word/231882/4
-                this_model_score = hmm_model.score(self.X, self.lengths)
-                other_model_scores = 0
+            # DIC = log(P(X(i)) - 1/(M-1)SUM(log(P(X(all but i))
+            dic_scores[i] = this_model_score - other_model_scores.mean()
+        return pd.Series(dic_scores, dtype=float)
 
-                m_count = 0
-                for word in self.words :
-                    if word == self.this_word :
-                        continue
-                    else :
-                        # print("Compare base word {} with {}".format(self.this_word,word))
+    def select(self):
+        best_model = None
+        best_num_components = 0
 
-                        X, lengths = self.hwords[word]
+        candidates = [i for i in range(self.min_n_components, self.max_n_components + 1) if i <= self._min_len]
+
+        logL_table = self.logL_table
+        if logL_table is None:
+            logL_table = build_logL_table(self.hwords, candidates, self.random_state, n_jobs=self.n_jobs)
+        else:
+            missing = [i for i in candidates if i not in logL_table.columns]
+            if missing:
+                # e.g. a table built for fewer states than max_n_components, score every word of the table so the
+                # mean over the other words covers the same words as in the other columns
+                other_Xlengths = {word: self.hwords[word] for word in logL_table.index if word in self.hwords}
+                logL_table = pd.concat([logL_table, build_logL_table(other_Xlengths, missing, self.random_state,
+                                                                     n_jobs=self.n_jobs)], axis=1)
+            if self.this_word not in logL_table.index:
+                # e.g. a table built from the other words only, score this word's models and add its row
+                this_row = build_logL_table({self.this_word: (self.X, self.lengths)}, logL_table.columns,
+                                            self.random_state, n_jobs=self.n_jobs)
+                logL_table = pd.concat([logL_table, this_row])
+
+        dic_scores = self.dic_scores(logL_table, candidates)
+        if len(dic_scores):
+            best_num_components = int(dic_scores.idxmax())
+
+        if best_num_components:
+            best_model = SelectorDIC.comparator_model(self.this_word, best_num_components, self.X, self.lengths,
+                                                      self.random_state)
 
-                        if i > lengths[0]:
-                            continue
+        return best_model
 
-                        other_hmm_model = GaussianHMM(n_components=i, covariance_type="diag", n_iter=1000,
-                                                      random_state=self.random_state, verbose=False).fit(X,
-                                                                                                         lengths)
 
-                        try:
-                            other_hmm_model_score = other_hmm_model.score(X, lengths)
-                        except Exception as e:
-                            # print(e)
-                            # print("Scoring of comparative model failed, base word {}, compare word {}".format(self.this_word,word))
-                            # Question to the reviewer - should I penalize an HmmLearn failure by setting other_hmm_model_score to float(-inf) or is 0 more appropriate?
-                            # Example error: rows of transmat_ must sum to 1.0 (got [ 1.  1.  1.  0.  1.  1.  0.  1.  1.])
-                            other_hmm_model_score = 0
+def build_logL_table(all_word_Xlengths, n_components_range, random_state=14, n_jobs=-1):
+    """ log likelihood of every word under its own model for every number of states
 
-                        other_model_scores += other_hmm_model_score
-                        m_count += 1
+    SelectorDIC only needs logL[word, i] = log(P(X(word) | HMM(word, i))) for all words, so the table is
+    shared by the selection of every target word instead of refitting all the other words per target word.
+    The entries are computed on a thread pool so they also fill the SelectorDIC caches of this process.
 
-                        # DIC = log(P(X(i)) - 1/(M-1)SUM(log(P(X(all but i))
+    :param all_word_Xlengths: dict of (X, lengths) tuples keyed by word
+    :param n_components_range: iterable of numbers of states
+    :param random_state: random state of the fitted models
+    :param n_jobs: number of threads
+    :return: pandas DataFrame indexed by word with a column per number of states, NaN where a model could
+        not be fit, fails hmmlearn's checks or has more states than the word's shortest sequence
+    """
+    words = list(all_word_Xlengths.keys())
+    n_components_range = list(n_components_range)
 
-                    dic_score = this_model_score - (1 / m_count) * other_model_scores
-                    # print("dic_score for {} is {}".format(i,dic_score))
+    entries = [(word, i) for word in words for i in n_components_range
+               if i <= min(all_word_Xlengths[word][1])]
 
-                    if dic_score > best_score:
-                        best_score = dic_score
-                        best_model = hmm_model
-                        best_num_components = i
+    # every model of a word scores the same X, convert it to the scoring layout once per word, not once per entry
+    feature_columns = {word: as_feature_columns(X) for word, (X, lengths) in all_word_Xlengths.items()}
+    fingerprints = {word: SelectorDIC._fingerprint(X) for word, (X, lengths) in all_word_Xlengths.items()}
 
-            except Exception as e:
-                continue
-                # print("Error for i = {} and word = {}".format(i,self.this_word))
-                # print(e)
+    scores = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(SelectorDIC.comparator_score)(word, i, *all_word_Xlengths[word], random_state,
+                                              X_cols=feature_columns[word], fingerprint=fingerprints[word])
+        for word, i in entries)
 
-        # print("Best score of {} for model with {} components".format(best_score, best_num_components))
-        return best_model
+    logL_table = pd.DataFrame(np.nan, index=words, columns=n_components_range)
+    for (word, i), score in zip(entries, scores):
+        logL_table.at[word, i] = score
+    return logL_table
 
 
 class SelectorCV(ModelSelector):
@@ -206,8 +357,6 @@ class SelectorCV(ModelSelector):
     '''
 
     def select(self):
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-
         word_sequences = self.sequences
         num_splits = self.min_n_components
 
@@ -217,32 +366,35 @@ class SelectorCV(ModelSelector):
         split_method = KFold(n_splits=num_splits)
         best_model = None
         best_num_components = 0
-
-        # The
         best_score = float("-inf")
 
-        for i in range(self.min_n_components,self.max_n_components) :
-
+        # the folds only depend on the split, not on i, so concatenate each of them once as numpy arrays rather
+        # than as lists that hmmlearn would convert again on every fit and score
+        fold_arrays = []
+        for cv_train_idx, cv_test_idx in split_method.split(word_sequences):
+            # print("Train fold indices:{} Test fold indices:{}".format(cv_train_idx, cv_test_idx))  # view indices of the folds
+            X, X_lengths = combine_sequences(cv_train_idx,word_sequences)
+            Y, Y_lengths = combine_sequences(cv_test_idx,word_sequences)
+            fold_arrays.append(((np.asarray(X, dtype=float), X_lengths), (np.asarray(Y, dtype=float), Y_lengths)))
+
+        # every (i, fold) pair is independent, fit and score all of them in one pool
+        candidates = [i for i in range(self.min_n_components,self.max_n_components) if i <= self._min_len]
+        fold_results = Parallel(n_jobs=self.n_jobs, prefer="processes")(
+            delayed(_fit_score_cv)(i, X, X_lengths, Y, Y_lengths, self.random_state)
+            for i in candidates for (X, X_lengths), (Y, Y_lengths) in fold_arrays)
+
+        for n, i in enumerate(candidates) :
+            hmm_model = None
             total_score = 0
 
-
-            for cv_train_idx, cv_test_idx in split_method.split(word_sequences):
-                # print("Train fold indices:{} Test fold indices:{}".format(cv_train_idx, cv_test_idx))  # view indices of the folds
-
-                X, X_lengths = combine_sequences(cv_train_idx,word_sequences)
-                Y, Y_lengths = combine_sequences(cv_test_idx,word_sequences)
-
-                try :
-
-                    hmm_model = GaussianHMM(n_components=i, covariance_type="diag", n_iter=1000,
-                                            random_state=self.random_state, verbose=False).fit(X, X_lengths)
-
-                    logL = hmm_model.score(Y, Y_lengths)
-                    total_score = total_score + logL
-
-                except Exception as e :
-                    # print(e)
+            for result in fold_results[n * len(fold_arrays):(n + 1) * len(fold_arrays)] :
+                if result is None :
                     continue
+                hmm_model, logL = result
+                total_score = total_score + logL
+
+            if hmm_model is None :
+                continue
 
             avg_score = total_score / num_splits
             # print("avg_score of {} for model with {} components".format(avg_score, i))
@@ -255,3 +407,22 @@ class SelectorCV(ModelSelector):
         # print("Best score of {} for model with {} components".format(best_score,best_num_components))
 
         return best_model
+
+
+def _fit_score_cv(i, X, X_lengths, Y, Y_lengths, random_state):
+    """ fit a SelectorCV candidate on one training fold and score it on the matching test fold
+
+    :return: (GaussianHMM, test fold log likelihood) or None if the fold could not be fit or scored
+    """
+    try :
+
+        hmm_model = GaussianHMM(n_components=i, random_state=random_state,
+                                **HMM_KW).fit(X, X_lengths)
+
+        logL = hmm_model.score(Y, Y_lengths)
+
+    except HMM_ERRORS as e :
+        # print(e)
+        return None
+
+    return hmm_model, logL
@@ -7,6 +7,8 @@ import importlib
 importlib.reload(my_model_selectors)
 import timeit
 
+FEATURES = ['right-y', 'right-x']
+
 
 class MyDICTest(unittest.TestCase):
 
@@ -24,10 +26,14 @@ class MyDICTest(unittest.TestCase):
     def test_something(self):
         sequences = self.training.get_all_sequences()
         Xlengths = self.training.get_all_Xlengths()
+        start = timeit.default_timer()
+        logL_table = my_model_selectors.build_logL_table(Xlengths, range(2, 16), random_state=14)
+        print("logL table built in {} seconds".format(timeit.default_timer() - start))
         for word in self.words_to_train:
             start = timeit.default_timer()
             model = my_model_selectors.SelectorDIC(sequences, Xlengths, word,
-                                                   min_n_components=2, max_n_components=15, random_state=14).select()
+                                                   min_n_components=2, max_n_components=15, random_state=14,
+                                                   logL_table=logL_table).select()
             end = timeit.default_timer() - start
             if model is not None:
                 print("Training complete for {} with {} states with time {} seconds".format(word, model.n_components,
@@ -36,5 +42,98 @@ class MyDICTest(unittest.TestCase):
                 print("Training failed for {}".format(word))
 
 
+class TestSelectorDIC(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        training = AslDb().build_training(FEATURES)
+        cls.sequences = training.get_all_sequences()
+        cls.xlengths = training.get_all_Xlengths()
+        cls.logL_table = my_model_selectors.build_logL_table(cls.xlengths, range(2, 11), random_state=14)
+
+    def test_selected_models_pass_check(self):
+        # words whose best DIC entry used to be a model failing hmmlearn's _check()
+        for word in ['CHICKEN', 'VEGETABLE', 'KNOW', 'NEW', 'CANDY', 'BLUE', 'BILL', 'THROW', 'BOX']:
+            model = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, word,
+                                                   logL_table=self.logL_table).select()
+            self.assertIsNotNone(model, word)
+            model._check()
+
+    def test_logL_table(self):
+        xlengths = {word: self.xlengths[word] for word in ['FRANK', 'JOHN', 'MARY']}
+        logL_table = my_model_selectors.build_logL_table(xlengths, range(2, 8), random_state=14)
+        self.assertEqual(list(logL_table.index), ['FRANK', 'JOHN', 'MARY'])
+        self.assertEqual(list(logL_table.columns), list(range(2, 8)))
+        for word, (X, lengths) in xlengths.items():
+            for i in logL_table.columns:
+                score = logL_table.at[word, i]
+                if i > min(lengths):
+                    # JOHN's shortest sequence has 5 frames
+                    self.assertTrue(np.isnan(score), (word, i))
+                else:
+                    expected = my_model_selectors.SelectorDIC.comparator_score(word, i, X, lengths, 14)
+                    np.testing.assert_equal(score, expected)
+        self.assertFalse(np.isnan(logL_table.at['JOHN', 5]))
+
+    def test_clear_cache(self):
+        X, lengths = self.xlengths['JOHN']
+        score = my_model_selectors.SelectorDIC.comparator_score('JOHN', 3, X, lengths, 14)
+        my_model_selectors.SelectorDIC.clear_cache()
+        self.assertEqual(len(my_model_selectors.SelectorDIC._model_cache), 0)
+        self.assertEqual(len(my_model_selectors.SelectorDIC._score_cache), 0)
+        # refit from scratch with the same random state
+        np.testing.assert_equal(my_model_selectors.SelectorDIC.comparator_score('JOHN', 3, X, lengths, 14), score)
+
+    def test_dic_scores(self):
+        logL_table = pd.DataFrame({2: [-100.0, -300.0, np.nan, -300.0],
+                                   3: [-200.0, -200.0, -200.0, np.nan],
+                                   4: [np.nan, -100.0, -100.0, -100.0],
+                                   5: [-50.0, np.nan, np.nan, np.nan]},
+                                  index=['FRANK', 'JOHN', 'MARY', 'TOY'])
+        selector = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, 'FRANK', max_n_components=5,
+                                                  logL_table=logL_table)
+        # this_word is left out of the mean and NaN entries are ignored, 4 has no score for FRANK and
+        # 5 no score for any other word, 6 is not in the table
+        dic_scores = selector.dic_scores(logL_table, range(2, 7))
+        pd.testing.assert_series_equal(dic_scores, pd.Series({2: 200.0, 3: 0.0}))
+        self.assertEqual(selector.select().n_components, 2)
+
+    def test_table_without_this_word(self):
+        logL_table = self.logL_table.drop('FRANK')
+        model = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, 'FRANK', logL_table=logL_table).select()
+        expected = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, 'FRANK',
+                                                  logL_table=self.logL_table).select()
+        self.assertEqual(model.n_components, expected.n_components)
+
+    def test_table_missing_candidates(self):
+        expected = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, 'FRANK',
+                                                  logL_table=self.logL_table).select()
+        # the states above 4 are scored for every word, also when the table has no row for FRANK
+        for logL_table in [self.logL_table[[2, 3, 4]], self.logL_table.drop('FRANK')[[2, 3]]]:
+            model = my_model_selectors.SelectorDIC(self.sequences, self.xlengths, 'FRANK',
+                                                   logL_table=logL_table).select()
+            self.assertEqual(model.n_components, expected.n_components)
+
+
+class TestSelectorBIC(unittest.TestCase):
+
+    def setUp(self):
+        training = AslDb().build_training(FEATURES)
+        self.sequences = training.get_all_sequences()
+        self.xlengths = training.get_all_Xlengths()
+
+    def test_early_stop_matches_exhaustive(self):
+        # FISH stops after 7 of its up to 10 states, FRANK runs to its best model at 9 states
+        for word in ['FISH', 'FRANK']:
+            expected = my_model_selectors.SelectorBIC(self.sequences, self.xlengths, word,
+                                                      early_stop=False).select()
+            # n_jobs sets the batch size, the cut-off must not depend on how candidates are batched
+            for n_jobs in [1, 2, 4]:
+                model = my_model_selectors.SelectorBIC(self.sequences, self.xlengths, word,
+                                                       early_stop=True, n_jobs=n_jobs).select()
+                self.assertEqual(model.n_components, expected.n_components, (word, n_jobs))
+                np.testing.assert_allclose(model.means_, expected.means_)
+
+
 if __name__ == '__main__':
     unittest.main()
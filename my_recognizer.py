@@ -1,13 +1,20 @@
 import warnings
+
+import numpy as np
+from joblib import Parallel, delayed
 from asl_data import SinglesData
+from my_scoring import as_feature_columns, frame_logprob_diag, log_parameters, sequences_logprob
+
+warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
-def recognize(models: dict, test_set: SinglesData):
+def recognize(models: dict, test_set: SinglesData, n_jobs=-1):
     """ Recognize test word sequences from word models set
 
    :param models: dict of trained models
        {'SOMEWORD': GaussianHMM model object, 'SOMEOTHERWORD': GaussianHMM model object, ...}
    :param test_set: SinglesData object
+   :param n_jobs: number of threads scoring models concurrently
    :return: (list, list)  as probabilities, guesses
        both lists are ordered by the test set word_id
        probabilities is a list of dictionaries where each key a word and value is Log Liklihood
@@ -17,30 +24,35 @@ def recognize(models: dict, test_set: SinglesData):
        guesses is a list of the best guess words ordered by the test set word_id
            ['WORDGUESS0', 'WORDGUESS1', 'WORDGUESS2',...]
    """
-    warnings.filterwarnings("ignore", category=DeprecationWarning)
     probabilities = []
     guesses = []
 
     best_word = None
 
     all_lengths = test_set.get_all_Xlengths()
-    for word_id in all_lengths.keys() :
-        test_sequence = all_lengths[word_id]
-        test_X = test_sequence[0]
-        test_Xlength = test_sequence[1]
+    word_ids = list(all_lengths.keys())
+    if not word_ids:
+        return probabilities, guesses
+
+    # stack every test sequence so each model evaluates its gaussians over all test frames at once
+    X_cols = as_feature_columns(np.concatenate([all_lengths[word_id][0] for word_id in word_ids]))
+    offsets = np.cumsum([0] + [sum(all_lengths[word_id][1]) for word_id in word_ids])
+
+    # score model by model so each model's parameters stay hot in cache across all test sequences, the models are
+    # independent and the scoring kernels release the GIL so they are spread over a thread pool
+    test_Xlengths = [all_lengths[word_id] for word_id in word_ids]
+    model_scores = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_score_model)(model, X_cols, offsets, test_Xlengths) for model in models.values())
+    scores = dict(zip(models.keys(), model_scores))
+
+    for idx, word_id in enumerate(word_ids) :
         test_word = test_set.wordlist[word_id]
         # print("Test word_id {} and word {}".format(word_id,test_word))
         prob_map = dict()
         max_prob = float("-inf")
 
-        for word, model in models.items():
-
-            try:
-                score = model.score(test_X,test_Xlength)
-            except Exception as e :
-                # print(e)
-                score = -1000
-
+        for word in models.keys():
+            score = scores[word][idx]
             prob_map[word] = score
             if score > max_prob :
                 max_prob = score
@@ -49,4 +61,44 @@ def recognize(models: dict, test_set: SinglesData):
         probabilities.append(prob_map)
         guesses.append(best_word)
 
-    return probabilities, guesses
\ No newline at end of file
+    return probabilities, guesses
+
+
+def _score_model(model, X_cols, offsets, test_Xlengths):
+    """ log likelihood of every stacked test sequence under one model
+
+    hmmlearn validates the model on every score call so the model is checked once here instead,
+    the scoring kernels only handle diagonal covariances so any other model is scored by hmmlearn
+
+    :param model: GaussianHMM object
+    :param X_cols: all test frames from as_feature_columns
+    :param offsets: array of the first frame of each test item in X_cols, plus the total number of frames
+    :param test_Xlengths: list of the (X, lengths) of each test item
+    :return: array of log likelihoods per test item, -1000 where the model cannot score it
+    """
+    scores = np.full(len(test_Xlengths), -1000.0)
+    if getattr(model, "covariance_type", None) != "diag":
+        for idx, (X, test_Xlength) in enumerate(test_Xlengths) :
+            try:
+                scores[idx] = model.score(X, test_Xlength)
+            except Exception as e :
+                # print(e)
+                continue
+        return scores
+
+    try:
+        model._check()
+        framelogprob_all = frame_logprob_diag(X_cols, model.means_, model._covars_)
+        log_startprob, log_transmat = log_parameters(model)
+    except Exception as e :
+        # print(e)
+        return scores
+
+    for idx, (X, test_Xlength) in enumerate(test_Xlengths) :
+        try:
+            framelogprob = framelogprob_all[offsets[idx]:offsets[idx + 1]]
+            scores[idx] = sequences_logprob(framelogprob, test_Xlength, log_startprob, log_transmat)
+        except Exception as e :
+            # print(e)
+            continue
+    return scores
@@ -0,0 +1,46 @@
+import unittest
+
+from asl_data import AslDb
+from hmmlearn.hmm import GaussianHMM
+from my_recognizer import recognize
+
+FEATURES = ['right-y', 'right-x']
+
+
+class MyRecognizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.asl = AslDb()
+        self.training = self.asl.build_training(FEATURES)
+        self.test_set = self.asl.build_test(FEATURES)
+
+    def test_recognize_full_covariance_models(self):
+        models = {}
+        for word in ['FRANK', 'CHICKEN', 'JOHN']:
+            X, lengths = self.training.get_word_Xlengths(word)
+            models[word] = GaussianHMM(n_components=3, covariance_type="full", n_iter=1000,
+                                       random_state=14).fit(X, lengths)
+        probs, guesses = recognize(models, self.test_set)
+        all_lengths = self.test_set.get_all_Xlengths()
+        for idx, word_id in enumerate(all_lengths.keys()):
+            X, lengths = all_lengths[word_id]
+            for word, model in models.items():
+                self.assertAlmostEqual(probs[idx][word], model.score(X, lengths), places=6)
+            self.assertEqual(guesses[idx], max(probs[idx], key=probs[idx].get))
+
+
+    def test_recognize_feature_mismatch(self):
+        # models of 2 features cannot score 4 feature data, hmmlearn raises and recognize records -1000
+        models = {}
+        for word in ['FRANK', 'JOHN']:
+            X, lengths = self.training.get_word_Xlengths(word)
+            models[word] = GaussianHMM(n_components=3, covariance_type="diag", n_iter=1000,
+                                       random_state=14).fit(X, lengths)
+        test_set = self.asl.build_test(FEATURES + ['left-y', 'left-x'])
+        probs, _ = recognize(models, test_set)
+        for prob_map in probs:
+            self.assertEqual(prob_map, {'FRANK': -1000, 'JOHN': -1000})
+
+
+if __name__ == '__main__':
+    unittest.main()
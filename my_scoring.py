@@ -0,0 +1,189 @@
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def as_feature_columns(X):
+    """ float32 structure of arrays copy of X, one contiguous row per feature column
+
+    The gaussian kernel streams one feature column at a time over all frames, so this layout
+    halves the memory traffic of a float64 (n_samples, n_features) array and keeps each
+    column contiguous.
+
+    :param X: array (n_samples, n_features)
+    :return: array (n_features, n_samples) of float32
+    """
+    return np.ascontiguousarray(np.asarray(X, dtype=np.float32).T)
+
+
+def _frame_logprob_diag_numpy(X_cols, means, inv_vars, log_norm):
+    d = X_cols[np.newaxis, :, :] - means[:, :, np.newaxis]
+    return log_norm[:, np.newaxis] - 0.5 * (d ** 2 * inv_vars[:, :, np.newaxis]).sum(axis=1)
+
+
+if njit is not None:
+    # not parallel=True, callers already run this from thread pools and numba's default workqueue threading
+    # layer does not support parallel kernels launched from several threads at once
+    @njit(fastmath=True, cache=True, nogil=True)
+    def _frame_logprob_diag_kernel(X_cols, means, inv_vars, log_norm):
+        n_features, n_samples = X_cols.shape
+        n_components = means.shape[0]
+        out = np.empty((n_components, n_samples))
+        for k in range(n_components):
+            row = out[k]
+            row[:] = log_norm[k]
+            for f in range(n_features):
+                col = X_cols[f]
+                mean = means[k, f]
+                half_inv_var = 0.5 * inv_vars[k, f]
+                for t in range(n_samples):
+                    d = col[t] - mean
+                    row[t] -= half_inv_var * d * d
+        return out
+else:
+    _frame_logprob_diag_kernel = _frame_logprob_diag_numpy
+
+
+def frame_logprob_diag(X_cols, means, covars):
+    """ per frame log likelihood of X under each state of a diagonal covariance gaussian model
+
+    Same computation as hmmlearn's diag log density, but callers can stack many sequences
+    into X and evaluate them in one call. Runs as a numba kernel when numba is installed.
+
+    :param X_cols: array (n_features, n_samples) from as_feature_columns(X)
+    :param means: array (n_components, n_features) the model means_
+    :param covars: array (n_components, n_features) diagonal covariances, the model _covars_
+    :return: array (n_samples, n_components)
+    """
+    n_features = means.shape[1]
+    # the numba kernel does no bounds checking, it would read past the end of means
+    if X_cols.shape[0] != n_features:
+        raise ValueError("expected {} feature columns, got {}".format(n_features, X_cols.shape[0]))
+    # hmmlearn rejects these too, fastmath kernels give undefined results on them
+    if not np.isfinite(X_cols).all():
+        raise ValueError("X contains NaN or infinity")
+    covars = np.maximum(covars, np.finfo(float).tiny)
+    inv_vars = 1 / covars
+    log_norm = -0.5 * (n_features * np.log(2 * np.pi) + np.log(covars).sum(axis=-1))
+    with np.errstate(over="ignore"):
+        return np.ascontiguousarray(_frame_logprob_diag_kernel(X_cols, means, inv_vars, log_norm).T)
+
+
+def _forward_logprob_numpy(framelogprob, log_startprob, log_transmat):
+    # each step is shifted by the max of the previous forward variables so the transition
+    # can be applied as a plain matrix product
+    transmat = np.exp(log_transmat)
+    fwd = log_startprob + framelogprob[0]
+    with np.errstate(divide="ignore"):
+        for t in range(1, len(framelogprob)):
+            shift = fwd.max()
+            if shift == -np.inf:
+                return shift
+            fwd = np.log(np.exp(fwd - shift).dot(transmat)) + shift + framelogprob[t]
+    shift = fwd.max()
+    if shift == -np.inf:
+        return shift
+    return shift + np.log(np.exp(fwd - shift).sum())
+
+
+if njit is not None:
+    # no "nnan"/"ninf" fast math flags, impossible transitions and start states are -inf
+    @njit(fastmath={"nsz", "arcp", "contract", "afn", "reassoc"}, cache=True, nogil=True)
+    def _forward_logprob_kernel(framelogprob, log_startprob, log_transmat):
+        n_samples, n_components = framelogprob.shape
+        fwd = log_startprob + framelogprob[0]
+        prev = np.empty(n_components)
+        for t in range(1, n_samples):
+            prev[:] = fwd
+            for j in range(n_components):
+                shift = -np.inf
+                for i in range(n_components):
+                    v = prev[i] + log_transmat[i, j]
+                    if v > shift:
+                        shift = v
+                if shift == -np.inf:
+                    fwd[j] = -np.inf
+                    continue
+                s = 0.0
+                for i in range(n_components):
+                    s += math.exp(prev[i] + log_transmat[i, j] - shift)
+                fwd[j] = framelogprob[t, j] + shift + math.log(s)
+        shift = fwd.max()
+        if shift == -np.inf:
+            return shift
+        s = 0.0
+        for j in range(n_components):
+            s += math.exp(fwd[j] - shift)
+        return shift + math.log(s)
+else:
+    _forward_logprob_kernel = _forward_logprob_numpy
+
+
+def forward_logprob(framelogprob, log_startprob, log_transmat):
+    """ log probability of a single sequence with the forward algorithm in log space
+
+    Runs as a numba kernel when numba is installed, for the short sequences and few states
+    of the ASL models the call overhead of a vectorized version dominates.
+
+    :param framelogprob: array (n_samples, n_components) of per frame state log likelihoods
+    :param log_startprob: array (n_components, ) log of the model startprob_
+    :param log_transmat: array (n_components, n_components) log of the model transmat_
+    :return: float log likelihood
+    """
+    return _forward_logprob_kernel(framelogprob, log_startprob, log_transmat)
+
+
+def log_parameters(model):
+    """ log of the model startprob_ and transmat_, computed once per model for forward_logprob
+
+    :param model: fitted GaussianHMM object
+    :return: (log_startprob, log_transmat)
+    """
+    with np.errstate(divide="ignore"):
+        return np.log(model.startprob_), np.log(model.transmat_)
+
+
+def sequences_logprob(framelogprob, lengths, log_startprob, log_transmat):
+    """ total log probability of the sequences stacked in framelogprob
+
+    :param framelogprob: array (n_samples, n_components) of per frame state log likelihoods
+    :param lengths: list of sequence lengths within framelogprob, None for a single sequence
+    :param log_startprob: array (n_components, ) log of the model startprob_
+    :param log_transmat: array (n_components, n_components) log of the model transmat_
+    :return: float log likelihood
+    """
+    if lengths is None:
+        lengths = [len(framelogprob)]
+
+    logprob = 0
+    start = 0
+    for length in lengths:
+        logprob += forward_logprob(framelogprob[start:start + length], log_startprob, log_transmat)
+        start += length
+    return logprob
+
+
+def fast_score(model, X_cols, lengths=None):
+    """ log likelihood of X under model, equivalent to model.score(X, lengths)
+
+    hmmlearn validates the model parameters and X on every score call, which dominates the
+    cost when the same models score many short sequences. The caller is expected to have run
+    model._check() once and to pass X already converted with as_feature_columns.
+
+    :param model: fitted GaussianHMM object with covariance_type "diag"
+    :param X_cols: array (n_features, n_samples) from as_feature_columns(X)
+    :param lengths: list of sequence lengths within X, None for a single sequence
+    :return: float log likelihood
+    """
+    framelogprob = frame_logprob_diag(X_cols, model.means_, model._covars_)
+    return sequences_logprob(framelogprob, lengths, *log_parameters(model))
+
+
+# compile the kernels at import rather than on the first scoring call
+forward_logprob(frame_logprob_diag(as_feature_columns(np.zeros((2, 1))), np.zeros((1, 1)), np.ones((1, 1))),
+                np.zeros(1), np.zeros((1, 1)))
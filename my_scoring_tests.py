@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+from asl_data import AslDb
+from asl_utils import train_all_words
+from my_model_selectors import SelectorConstant
+from my_scoring import as_feature_columns, fast_score, frame_logprob_diag
+
+FEATURES = ['right-y', 'right-x']
+
+
+class MyScoringTest(unittest.TestCase):
+
+    def setUp(self):
+        self.asl = AslDb()
+        self.training = self.asl.build_training(FEATURES)
+        self.test_set = self.asl.build_test(FEATURES)
+        self.models = train_all_words(self.training, SelectorConstant)
+
+    def test_fast_score_matches_score(self):
+        all_lengths = self.test_set.get_all_Xlengths()
+        for word in ['FRANK', 'CHICKEN', 'JOHN']:
+            model = self.models[word]
+            model._check()
+            for word_id in list(all_lengths.keys())[:10]:
+                X, lengths = all_lengths[word_id]
+                self.assertAlmostEqual(fast_score(model, as_feature_columns(X), lengths),
+                                       model.score(X, lengths), places=6)
+
+    def test_frame_logprob_diag_matches_model(self):
+        X, lengths = self.test_set.get_item_Xlengths(0)
+        X = np.asarray(X, dtype=float)
+        for word in ['FRANK', 'CHICKEN', 'JOHN']:
+            model = self.models[word]
+            np.testing.assert_allclose(frame_logprob_diag(as_feature_columns(X), model.means_, model._covars_),
+                                       model._compute_log_likelihood(X), rtol=1e-5)
+
+
+    def test_frame_logprob_diag_rejects_feature_mismatch(self):
+        X, lengths = self.test_set.get_item_Xlengths(0)
+        X_cols = as_feature_columns(np.hstack([X, X]))
+        model = self.models['FRANK']
+        with self.assertRaises(ValueError):
+            frame_logprob_diag(X_cols, model.means_, model._covars_)
+
+    def test_frame_logprob_diag_rejects_non_finite(self):
+        X, lengths = self.test_set.get_item_Xlengths(0)
+        X = np.array(X, dtype=float)
+        X[0, 0] = np.nan
+        model = self.models['FRANK']
+        with self.assertRaises(ValueError):
+            frame_logprob_diag(as_feature_columns(X), model.means_, model._covars_)
+
+if __name__ == '__main__':
+    unittest.main()